@@ -1,332 +1,684 @@
-#!usrbinenv python
-
+#!/usr/bin/env python
+"""
 Compare two Google Tag Manager containers (field-level) and export differences to CSV.
 
-Dependencies (install via pip)
-    pip install google-api-python-client google-auth google-auth-oauthlib
+Dependencies (install via pip):
+    pip install google-api-python-client google-auth google-auth-oauthlib orjson xxhash
 
-Usage
+Usage:
     1. Set GTM_OAUTH_PATH env var OR edit CRED_PATH default.
     2. Set ACCOUNT_NAME and container names in the main() section.
-    3. Run
+    3. Run:
         python gtm_container_diff.py
-
+"""
 
 from __future__ import annotations
 
-import csv
+import functools
 import os
+import threading
 from pathlib import Path
-from typing import Any, Dict, List
+from typing import Any, Dict, Iterator, List, Tuple
 
+import orjson
+import xxhash
 from google.oauth2.credentials import Credentials
 from google_auth_oauthlib.flow import InstalledAppFlow
 from google.auth.transport.requests import Request
 from googleapiclient.discovery import build
 
 
-# --- Configuration  auth paths ------------------------------------------------
+# --- Configuration / auth paths ------------------------------------------------
 
-SCOPES = [httpswww.googleapis.comauthtagmanager.readonly]
+SCOPES = ["https://www.googleapis.com/auth/tagmanager.readonly"]
 
 # Either set env vars or hard-code a fallback path
-CRED_PATH = Path(os.environ.get(GTM_OAUTH_PATH, pathtoyourclient_secret.json))
-TOKEN_PATH = Path(os.environ.get(GTM_TOKEN_PATH, token.json))
+CRED_PATH = Path(os.environ.get("GTM_OAUTH_PATH", "/path/to/your/client_secret.json"))
+TOKEN_PATH = Path(os.environ.get("GTM_TOKEN_PATH", "token.json"))
+
+# Workspace entity collections, and the key holding the items in a list response
+ENTITY_TYPES = ("tags", "triggers", "variables")
+LIST_RESPONSE_KEYS = {"tags": "tag", "triggers": "trigger", "variables": "variable"}
+
+# (name field, fallback ID field) used to key each entity type in a snapshot
+ENTITY_ID_FIELDS = {
+    "tags": ("name", "tagId"),
+    "triggers": ("name", "triggerId"),
+    "variables": ("name", "variableId"),
+}
+
+# Partial-response projections: every field that ends up in the diff, and none of
+# the environment-specific metadata that strip_meta_fields() would discard anyway.
+ENTITY_FIELDS = {
+    "tags": (
+        "name,tagId,type,parameter,firingTriggerId,blockingTriggerId,"
+        "firingRuleId,blockingRuleId,liveOnly,priority,notes,scheduleStartMs,"
+        "scheduleEndMs,setupTag,teardownTag,tagFiringOption,paused,"
+        "monitoringMetadata,monitoringMetadataTagNameKey,consentSettings"
+    ),
+    "triggers": (
+        "name,triggerId,type,parameter,customEventFilter,filter,autoEventFilter,"
+        "waitForTags,checkValidation,waitForTagsTimeout,uniqueTriggerId,eventName,"
+        "interval,limit,selector,intervalSeconds,maxTimerLengthSeconds,"
+        "verticalScrollPercentageList,horizontalScrollPercentageList,"
+        "visibilitySelector,visiblePercentageMin,visiblePercentageMax,"
+        "continuousTimeMinMilliseconds,totalTimeMinMilliseconds,notes"
+    ),
+    "variables": (
+        "name,variableId,type,parameter,notes,scheduleStartMs,scheduleEndMs,"
+        "enablingTriggerId,disablingTriggerId,formatValue"
+    ),
+}
+
+# Noisy / environment-specific keys removed by strip_meta_fields()
+_REMOVE_KEYS = frozenset(
+    {
+        "path",
+        "tagManagerUrl",
+        "fingerprint",
+        "accountId",
+        "containerId",
+        "workspaceId",
+        "parentFolderId",
+    }
+)
 
 
 # --- Auth & service helpers ----------------------------------------------------
 
 
-def get_gtm_service()
-    Return an authenticated GTM API service client.
+_CREDENTIALS_LOCK = threading.Lock()
+
+
+def get_credentials() -> Credentials:
+    """
+    Return the OAuth credentials shared by every GTM client in the process.
+
+    The token file is read (and the consent flow run, if needed) only on
+    the first call; the lock keeps concurrent first calls from racing.
+    """
+    with _CREDENTIALS_LOCK:
+        return _load_credentials()
+
+
+@functools.lru_cache(maxsize=None)
+def _load_credentials() -> Credentials:
     creds = None
 
-    if TOKEN_PATH.exists()
+    if TOKEN_PATH.exists():
         creds = Credentials.from_authorized_user_file(str(TOKEN_PATH), SCOPES)
 
-    if not creds or not creds.valid
-        if creds and creds.expired and creds.refresh_token
+    if not creds or not creds.valid:
+        if creds and creds.expired and creds.refresh_token:
             creds.refresh(Request())
-        else
-            if not CRED_PATH.exists()
+        else:
+            if not CRED_PATH.exists():
                 raise FileNotFoundError(
-                    fClient secret file not found at {CRED_PATH}. 
-                    Set GTM_OAUTH_PATH or update CRED_PATH.
+                    f"Client secret file not found at {CRED_PATH}. "
+                    "Set GTM_OAUTH_PATH or update CRED_PATH."
                 )
             flow = InstalledAppFlow.from_client_secrets_file(str(CRED_PATH), SCOPES)
             creds = flow.run_local_server(port=0)
 
+        # Only persist the token when it was refreshed or newly granted
         TOKEN_PATH.write_text(creds.to_json())
 
-    return build(tagmanager, v2, credentials=creds)
+    return creds
+
+
+def save_credentials() -> None:
+    """
+    Write the shared credentials back to the token file if they changed.
+
+    Clients refresh an expired access token on their own during a long
+    run; without this the refreshed token never reaches token.json.
+    """
+    token_json = get_credentials().to_json()
+    if not TOKEN_PATH.exists() or TOKEN_PATH.read_text() != token_json:
+        TOKEN_PATH.write_text(token_json)
+
+
+def build_gtm_service():
+    """
+    Build a new GTM API service client on the shared credentials.
+
+    Each client has its own httplib2.Http, which is not thread-safe, so
+    code that calls the API from several threads should build one client
+    per thread with this function.
+    """
+    return build("tagmanager", "v2", credentials=get_credentials())
+
+
+@functools.lru_cache(maxsize=None)
+def get_gtm_service():
+    """
+    Return the process-wide GTM API service client.
+
+    The client is built once and reused, so later calls keep the same
+    authorized HTTP connection. It is for single-threaded use only; see
+    build_gtm_service() for multi-threaded callers.
+    """
+    return build_gtm_service()
 
 
 # --- GTM lookup helpers --------------------------------------------------------
 
 
-def find_account_id(service, account_name str) - str
-    Return the accountId for a given account display name.
-    result = service.accounts().list().execute()
-    accounts = result.get(account, [])
+def list_all(list_method, items_key: str, fields: str, **kwargs) -> List[Dict[str, Any]]:
+    """
+    Call a GTM ``list`` method with a partial-response projection and
+    follow ``nextPageToken`` until every page has been read.
+    """
+    items: List[Dict[str, Any]] = []
+    params = dict(kwargs, fields=f"nextPageToken,{items_key}({fields})")
+
+    while True:
+        result = list_method(**params).execute()
+        items.extend(result.get(items_key, []))
+        page_token = result.get("nextPageToken")
+        if not page_token:
+            return items
+        params["pageToken"] = page_token
+
 
-    for acc in accounts
-        if acc.get(name) == account_name or acc.get(displayName) == account_name
-            return acc[accountId]
+def find_account_id(service, account_name: str) -> str:
+    """Return the accountId for a given account display name."""
+    accounts = list_all(service.accounts().list, "account", "accountId,name")
 
-    raise ValueError(fGTM account not found with name {account_name!r})
+    for acc in accounts:
+        if acc.get("name") == account_name or acc.get("displayName") == account_name:
+            return acc["accountId"]
 
+    raise ValueError(f"GTM account not found with name {account_name!r}")
 
-def find_container(service, account_id str, container_name str) - Dict[str, Any]
-    Return the container dict for a given name within an account.
-    parent = faccounts{account_id}
-    result = service.accounts().containers().list(parent=parent).execute()
-    containers = result.get(container, [])
 
-    for c in containers
-        if c.get(name) == container_name
+def find_container(service, account_id: str, container_name: str) -> Dict[str, Any]:
+    """Return the container dict for a given name within an account."""
+    parent = f"accounts/{account_id}"
+    containers = list_all(
+        service.accounts().containers().list, "container", "name,path", parent=parent
+    )
+
+    for c in containers:
+        if c.get("name") == container_name:
             return c
 
     raise ValueError(
-        fGTM container not found with name {container_name!r} in account {account_id}
+        f"GTM container not found with name {container_name!r} in account {account_id}"
     )
 
 
-def find_default_workspace(service, container_path str) - Dict[str, Any]
-    Return the default workspace (by name or first) for a container.
-    result = (
-        service.accounts()
-        .containers()
-        .workspaces()
-        .list(parent=container_path)
-        .execute()
+def find_default_workspace(service, container_path: str) -> Dict[str, Any]:
+    """Return the default workspace (by name or first) for a container."""
+    workspaces = list_all(
+        service.accounts().containers().workspaces().list,
+        "workspace",
+        "name,path",
+        parent=container_path,
     )
-    workspaces = result.get(workspace, [])
-    if not workspaces
-        raise RuntimeError(fNo workspaces found for container {container_path})
+    if not workspaces:
+        raise RuntimeError(f"No workspaces found for container {container_path}")
 
-    for ws in workspaces
-        if ws.get(name, ).lower() == default workspace
+    for ws in workspaces:
+        if ws.get("name", "").lower() == "default workspace":
             return ws
 
     # Fall back to the first workspace if no 'Default Workspace' by name
     return workspaces[0]
 
 
-# --- Snapshot & normalization --------------------------------------------------
+def fetch_workspace_entities(
+    service, workspace_paths: List[str]
+) -> Dict[str, Dict[str, List[Dict[str, Any]]]]:
+    """
+    Fetch tags, triggers and variables for one or more workspaces in a
+    single batched HTTP request (plus one more batch per extra page):
 
+        {workspace_path: {"tags": [...], "triggers": [...], "variables": [...]}}
 
-def strip_meta_fields(obj Any) - Any
-    Remove noisy  environment-specific fields from a GTM object.
-    remove_keys = {
-        path,
-        tagManagerUrl,
-        fingerprint,
-        accountId,
-        containerId,
-        workspaceId,
-        parentFolderId,
+    A path given more than once is only fetched once.
+    """
+    # Deduplicate (keeping order) so each list request is sent only once
+    workspace_paths = list(dict.fromkeys(workspace_paths))
+    results: Dict[str, Dict[str, List[Dict[str, Any]]]] = {
+        path: {entity_type: [] for entity_type in ENTITY_TYPES}
+        for path in workspace_paths
     }
+    # (workspace_path, entity_type, page_token) still to be fetched
+    pending = [
+        (path, entity_type, None)
+        for path in workspace_paths
+        for entity_type in ENTITY_TYPES
+    ]
+    workspaces = service.accounts().containers().workspaces()
+
+    while pending:
+        request_keys: Dict[str, tuple] = {}
+        next_pending: List[tuple] = []
+        errors: List[Exception] = []
+
+        def on_response(request_id: str, response: Dict[str, Any], exception) -> None:
+            if exception is not None:
+                errors.append(exception)
+                return
+            path, entity_type = request_keys[request_id]
+            items_key = LIST_RESPONSE_KEYS[entity_type]
+            results[path][entity_type].extend(response.get(items_key, []))
+            if response.get("nextPageToken"):
+                next_pending.append((path, entity_type, response["nextPageToken"]))
+
+        batch = service.new_batch_http_request(callback=on_response)
+        for path, entity_type, page_token in pending:
+            request_id = str(len(request_keys))
+            request_keys[request_id] = (path, entity_type)
+            params = {
+                "parent": path,
+                "fields": (
+                    f"nextPageToken,{LIST_RESPONSE_KEYS[entity_type]}"
+                    f"({ENTITY_FIELDS[entity_type]})"
+                ),
+            }
+            if page_token:
+                params["pageToken"] = page_token
+            collection = getattr(workspaces, entity_type)()
+            batch.add(collection.list(**params), request_id=request_id)
+        batch.execute()
+
+        if errors:
+            raise errors[0]
+        pending = next_pending
+
+    return results
 
-    if isinstance(obj, dict)
-        return {
-            k strip_meta_fields(v)
-            for k, v in obj.items()
-            if k not in remove_keys
-        }
-    if isinstance(obj, list)
-        return [strip_meta_fields(v) for v in obj]
-    return obj
 
+# --- Snapshot & normalization --------------------------------------------------
 
-def build_entity_map(items List[Dict[str, Any]]) - Dict[str, Dict[str, Any]]
-    
-    Build a map of entity_name - normalized entity dict.
 
-    Falls back to ID if name is missing.
-    
-    out Dict[str, Dict[str, Any]] = {}
-    for item in items
-        name = (
-            item.get(name)
-            or item.get(tagId)
-            or item.get(triggerId)
-            or item.get(variableId)
-        )
-        if not name
+def strip_meta_fields(obj: Any) -> Any:
+    """
+    Remove noisy / environment-specific fields from a GTM object.
+
+    The object is modified in place (API responses are ours to mutate) and
+    returned for convenience.
+    """
+    stack = [obj]
+
+    while stack:
+        value = stack.pop()
+        if isinstance(value, dict):
+            for k in _REMOVE_KEYS.intersection(value):
+                del value[k]
+            stack.extend(value.values())
+        elif isinstance(value, list):
+            stack.extend(value)
+
+    return obj
+
+
+def build_entity_map(
+    items: List[Dict[str, Any]],
+    entity_type: str,
+) -> Dict[str, Tuple[int, Dict[str, Any]]]:
+    """
+    Build a map of entity_name -> (content_hash, normalized entity dict).
+
+    The hash is a 64-bit xxHash of the canonical (sorted-key) orjson
+    encoding of the normalized entity, so unchanged entities are matched
+    with a single integer compare.
+    ``entity_type`` ("tags", "triggers" or "variables") selects the ID field
+    used as a fallback when the name is missing (see ENTITY_ID_FIELDS).
+    """
+    name_field, id_field = ENTITY_ID_FIELDS[entity_type]
+    out: Dict[str, Tuple[int, Dict[str, Any]]] = {}
+    for item in items:
+        name = item.get(name_field) or item.get(id_field)
+        if not name:
             # skip unnamed items to keep things sane
             continue
-        out[name] = strip_meta_fields(item)
+        normalized = strip_meta_fields(item)
+        canonical = orjson.dumps(normalized, option=orjson.OPT_SORT_KEYS)
+        out[name] = (xxhash.xxh64_intdigest(canonical), normalized)
     return out
 
 
-def snapshot_container(service, account_name str, container_name str) - Dict[str, Any]
-    
-    Fetch a 'snapshot' of a container's tags, triggers, and variables
-    from its default workspace.
-    
+def snapshot_containers(
+    service, account_name: str, container_names: List[str]
+) -> List[Dict[str, Any]]:
+    """
+    Fetch a 'snapshot' of the tags, triggers, and variables of each
+    container's default workspace, in the order of ``container_names``.
+
+    All workspace entities are fetched with one batched request.
+    """
     account_id = find_account_id(service, account_name)
-    container = find_container(service, account_id, container_name)
-    container_path = container[path]
-
-    workspace = find_default_workspace(service, container_path)
-    workspace_path = workspace[path]
-
-    tags_result = (
-        service.accounts()
-        .containers()
-        .workspaces()
-        .tags()
-        .list(parent=workspace_path)
-        .execute()
-    )
-    triggers_result = (
-        service.accounts()
-        .containers()
-        .workspaces()
-        .triggers()
-        .list(parent=workspace_path)
-        .execute()
-    )
-    variables_result = (
-        service.accounts()
-        .containers()
-        .workspaces()
-        .variables()
-        .list(parent=workspace_path)
-        .execute()
-    )
 
-    tags = tags_result.get(tag, [])
-    triggers = triggers_result.get(trigger, [])
-    variables = variables_result.get(variable, [])
+    workspace_paths: List[str] = []
+    for container_name in container_names:
+        container = find_container(service, account_id, container_name)
+        workspace = find_default_workspace(service, container["path"])
+        workspace_paths.append(workspace["path"])
 
-    return {
-        tags build_entity_map(tags),
-        triggers build_entity_map(triggers),
-        variables build_entity_map(variables),
-    }
+    entities = fetch_workspace_entities(service, workspace_paths)
+
+    return [
+        {
+            entity_type: build_entity_map(entities[path][entity_type], entity_type)
+            for entity_type in ENTITY_TYPES
+        }
+        for path in workspace_paths
+    ]
+
+
+def snapshot_container(service, account_name: str, container_name: str) -> Dict[str, Any]:
+    """
+    Fetch a 'snapshot' of a container's tags, triggers, and variables
+    from its default workspace.
+    """
+    return snapshot_containers(service, account_name, [container_name])[0]
 
 
 # --- Diff helpers --------------------------------------------------------------
 
 
-def flatten(obj Any, prefix str = ) - Dict[str, Any]
-    
-    Flatten nested dictlist structures into a single-level dict
+def flatten(obj: Any, prefix: str = "") -> Dict[str, str]:
+    """
+    Flatten nested dict/list structures into a single-level dict of
+    canonical strings (None becomes ""):
 
-        {a {b [1, 2]}}
-        - {a.b[0] 1, a.b[1] 2}
-    
-    items Dict[str, Any] = {}
+        {"a": {"b": [1, None]}}
+        -> {"a.b[0]": "1", "a.b[1]": ""}
 
-    if isinstance(obj, dict)
-        for k, v in obj.items()
-            new_prefix = f{prefix}.{k} if prefix else k
-            items.update(flatten(v, new_prefix))
-    elif isinstance(obj, list)
-        for idx, v in enumerate(obj)
-            new_prefix = f{prefix}[{idx}]
-            items.update(flatten(v, new_prefix))
-    else
-        items[prefix] = obj
+    Walks an explicit stack and writes leaves straight into the output
+    dict. Children are pushed in reverse so keys come out in document order.
+    """
+    items: Dict[str, str] = {}
+    stack = [(obj, prefix)]
+
+    while stack:
+        value, path = stack.pop()
+        if isinstance(value, dict):
+            for k in reversed(value):
+                stack.append((value[k], path + "." + k if path else k))
+        elif isinstance(value, list):
+            for idx in range(len(value) - 1, -1, -1):
+                stack.append((value[idx], f"{path}[{idx}]"))
+        else:
+            items[path] = str(value) if value is not None else ""
 
     return items
 
 
+# Placeholder for a key / list index that only exists on one side
+_MISSING = object()
+
+
+def diff_values(a: Any, b: Any, prefix: str = "") -> Iterator[Tuple[str, str, str]]:
+    """
+    Yield (field_path, value_a, value_b) for every leaf that differs between
+    two nested structures, with the same paths and string values as
+    comparing flatten(a) against flatten(b); a missing leaf is "".
+
+    Both sides are walked together and any container subtree that is equal,
+    typically a long unchanged "parameter" list, is skipped without being
+    flattened. Leaves are always compared as their strings, and an equal
+    container is only skipped if its JSON encoding matches too, because ==
+    treats True, 1 and 1.0 as the same value. Two differing leaves are
+    reported directly; only subtrees whose shapes diverge (e.g. a list
+    replaced by a string) are flattened.
+    """
+    stack = [(a, b, prefix)]
+
+    while stack:
+        va, vb, path = stack.pop()
+
+        if not isinstance(va, (dict, list)) and not isinstance(vb, (dict, list)):
+            # leaf vs leaf (or vs a missing key): compare in place, no dicts
+            leaf_a = "" if va is _MISSING or va is None else str(va)
+            leaf_b = "" if vb is _MISSING or vb is None else str(vb)
+            if leaf_a != leaf_b:
+                yield path, leaf_a, leaf_b
+            continue
+
+        if va == vb and orjson.dumps(va) == orjson.dumps(vb):
+            continue
+
+        if isinstance(va, dict) and isinstance(vb, dict):
+            # keys only B has are pushed first so they come out last
+            for k in reversed(vb):
+                if k not in va:
+                    stack.append((_MISSING, vb[k], path + "." + k if path else k))
+            for k in reversed(va):
+                stack.append((va[k], vb.get(k, _MISSING), path + "." + k if path else k))
+            continue
+
+        if isinstance(va, list) and isinstance(vb, list):
+            len_a, len_b = len(va), len(vb)
+            for idx in range(max(len_a, len_b) - 1, -1, -1):
+                stack.append(
+                    (
+                        va[idx] if idx < len_a else _MISSING,
+                        vb[idx] if idx < len_b else _MISSING,
+                        f"{path}[{idx}]",
+                    )
+                )
+            continue
+
+        flat_a = flatten(va, path) if va is not _MISSING else {}
+        flat_b = flatten(vb, path) if vb is not _MISSING else {}
+
+        for field_path, leaf_a in flat_a.items():
+            leaf_b = flat_b.get(field_path, "")
+            if leaf_a != leaf_b:
+                yield field_path, leaf_a, leaf_b
+
+        for field_path, leaf_b in flat_b.items():
+            if leaf_b and field_path not in flat_a:
+                yield field_path, "", leaf_b
+
+
+def diff_entity(a: Dict[str, Any], b: Dict[str, Any]) -> Iterator[Tuple[str, str, str]]:
+    """
+    diff_values() specialised for two GTM entities whose content hashes
+    already differ.
+
+    An entity is always a dict of top-level fields (name, type, parameter,
+    firingTriggerId, ...), so the whole-entity equality test and type
+    dispatch at the root are skipped and each field is diffed directly.
+    """
+    for key, va in a.items():
+        yield from diff_values(va, b.get(key, _MISSING), key)
+
+    for key, vb in b.items():
+        if key not in a:
+            yield from diff_values(_MISSING, vb, key)
+
+
+def _diff_one_type(
+    entity_type: str,
+    map_a: Dict[str, Any],
+    map_b: Dict[str, Any],
+    label_a: str,
+    label_b: str,
+) -> Iterator[Dict[str, Any]]:
+    """Yield the diff rows for a single entity type (see diff_snapshots)."""
+    # One pass over A (in API order), then the names only B has;
+    # no set union and no sort.
+    for name, entry_a in map_a.items():
+        entry_b = map_b.get(name)
+
+        if entry_b is None:
+            yield {
+                "entity_type": entity_type,
+                "entity_name": name,
+                "field_path": "__entity__",
+                "value_a": "present",
+                "value_b": "",
+                "label_a": label_a,
+                "label_b": label_b,
+                "change_type": "only_in_a",
+            }
+            continue
+
+        hash_a, a = entry_a
+        hash_b, b = entry_b
+        if hash_a == hash_b:
+            # identical content: nothing to compare
+            continue
+
+        for path, va, vb in diff_entity(a, b):
+            yield {
+                "entity_type": entity_type,
+                "entity_name": name,
+                "field_path": path,
+                "value_a": va,
+                "value_b": vb,
+                "label_a": label_a,
+                "label_b": label_b,
+                "change_type": "modified",
+            }
+
+    # Key-view difference runs in C; B is only walked again (to keep
+    # its order) when it actually has names A lacks.
+    only_in_b = map_b.keys() - map_a.keys()
+    if not only_in_b:
+        return
+
+    for name in map_b:
+        if name not in only_in_b:
+            continue
+        yield {
+            "entity_type": entity_type,
+            "entity_name": name,
+            "field_path": "__entity__",
+            "value_a": "",
+            "value_b": "present",
+            "label_a": label_a,
+            "label_b": label_b,
+            "change_type": "only_in_b",
+        }
+
+
 def diff_snapshots(
-    snap_a Dict[str, Any],
-    snap_b Dict[str, Any],
-    label_a str = A,
-    label_b str = B,
-) - List[Dict[str, Any]]
-    
+    snap_a: Dict[str, Any],
+    snap_b: Dict[str, Any],
+    label_a: str = "A",
+    label_b: str = "B",
+) -> Iterator[Dict[str, Any]]:
+    """
     Compute field-level differences between two container snapshots.
 
-    Returns a list of rows suitable for CSV export
+    Yields rows suitable for CSV export, one at a time:
         {
-            entity_type tagtriggervariable,
-            entity_name ...,
-            field_path parameters[0].value,
-            value_a ...,
-            value_b ...,
-            label_a label_a,
-            label_b label_b,
-            change_type only_in_aonly_in_bmodified
+            "entity_type": "tag|trigger|variable",
+            "entity_name": "...",
+            "field_path": "parameters[0].value",
+            "value_a": "...",
+            "value_b": "...",
+            "label_a": label_a,
+            "label_b": label_b,
+            "change_type": "only_in_a|only_in_b|modified"
         }
-    
-    rows List[Dict[str, Any]] = []
-
-    for entity_type in (tags, triggers, variables)
-        map_a Dict[str, Any] = snap_a.get(entity_type, {})
-        map_b Dict[str, Any] = snap_b.get(entity_type, {})
-
-        names = sorted(set(map_a.keys())  set(map_b.keys()))
-
-        for name in names
-            a = map_a.get(name)
-            b = map_b.get(name)
-
-            if a is None
-                rows.append(
-                    {
-                        entity_type entity_type,
-                        entity_name name,
-                        field_path __entity__,
-                        value_a ,
-                        value_b present,
-                        label_a label_a,
-                        label_b label_b,
-                        change_type only_in_b,
-                    }
-                )
-                continue
-
-            if b is None
-                rows.append(
-                    {
-                        entity_type entity_type,
-                        entity_name name,
-                        field_path __entity__,
-                        value_a present,
-                        value_b ,
-                        label_a label_a,
-                        label_b label_b,
-                        change_type only_in_a,
-                    }
-                )
-                continue
-
-            flat_a = flatten(a)
-            flat_b = flatten(b)
-            field_paths = sorted(set(flat_a.keys())  set(flat_b.keys()))
-
-            for path in field_paths
-                va = flat_a.get(path)
-                vb = flat_b.get(path)
-                if va == vb
-                    continue
-                rows.append(
-                    {
-                        entity_type entity_type,
-                        entity_name name,
-                        field_path path,
-                        value_a va if va is not None else ,
-                        value_b vb if vb is not None else ,
-                        label_a label_a,
-                        label_b label_b,
-                        change_type modified,
-                    }
-                )
+    """
+    for entity_type in ENTITY_TYPES:
+        yield from _diff_one_type(
+            entity_type,
+            snap_a.get(entity_type, {}),
+            snap_b.get(entity_type, {}),
+            label_a,
+            label_b,
+        )
+
+
+CSV_FIELDNAMES = [
+    "entity_type",
+    "entity_name",
+    "field_path",
+    "value_a",
+    "value_b",
+    "label_a",
+    "label_b",
+    "change_type",
+]
+
+# Same output as csv.writer's default "excel" dialect (QUOTE_MINIMAL, \r\n)
+CSV_HEADER = ",".join(CSV_FIELDNAMES) + "\r\n"
 
-    return rows
+
+def csv_field(value: Any) -> str:
+    """Format a single CSV field, quoting only when it has to be quoted."""
+    if value is None:
+        return ""
+    text = value if isinstance(value, str) else str(value)
+    if '"' in text:
+        return '"' + text.replace('"', '""') + '"'
+    if "," in text or "\n" in text or "\r" in text:
+        return '"' + text + '"'
+    return text
 
 
 def export_internal_diffs_csv(
-    snap_a Dict[str, Any],
-    snap_b Dict[str, Any],
-    label_a str,
-    label_b str,
-    filename str,
-) - None
+    snap_a: Dict[str, Any],
+    snap_b: Dict[str, Any],
+    label_a: str,
+    label_b: str,
+    filename: str,
+) -> None:
+    """
     Write snapshot differences to a CSV file.
+
+    Rows are formatted by hand rather than through csv.DictWriter: the
+    schema is fixed, entity_type / change_type never need quoting and the
+    two labels are the same on every row, so they are formatted once.
+    """
     rows = diff_snapshots(snap_a, snap_b, label_a=label_a, label_b=label_b)
+    labels = csv_field(label_a) + "," + csv_field(label_b) + ","
+    count = 0
+
+    # Stream rows straight from the generator into a 1 MiB write buffer
+    with open(filename, "w", newline="", encoding="utf-8", buffering=1 << 20) as f:
+        write = f.write
+        write(CSV_HEADER)
+        for row in rows:
+            write(
+                row["entity_type"]
+                + ","
+                + csv_field(row["entity_name"])
+                + ","
+                + csv_field(row["field_path"])
+                + ","
+                + csv_field(row["value_a"])
+                + ","
+                + csv_field(row["value_b"])
+                + ","
+                + labels
+                + row["change_type"]
+                + "\r\n"
+            )
+            count += 1
+
+    print(f"Wrote {count} differences to {filename}")
+
+
+# --- Main ----------------------------------------------------------------------
+
+
+def main() -> None:
+    account_name = "YOUR_ACCOUNT_NAME"
+    container_a = "YOUR_CONTAINER_A"
+    container_b = "YOUR_CONTAINER_B"
+
+    service = get_gtm_service()
+    snap_a, snap_b = snapshot_containers(service, account_name, [container_a, container_b])
+
+    export_internal_diffs_csv(
+        snap_a,
+        snap_b,
+        label_a=container_a,
+        label_b=container_b,
+        filename="gtm_container_diff.csv",
+    )
+    save_credentials()
+
+
+if __name__ == "__main__":
+    main()